@@ -1,13 +1,22 @@
 from __future__ import annotations
 
 import json
+import mmap
 import os
 import shlex
+from collections.abc import Iterator
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+try:
+    from orjson import JSONDecodeError, loads as json_loads
+except ImportError:
+    from json import JSONDecodeError, loads as json_loads
 
 from harbor.agents.installed.base import BaseInstalledAgent, ExecInput
-from harbor.models.agent.context import AgentContext
-from harbor.models.trial.paths import EnvironmentPaths
+
+if TYPE_CHECKING:
+    from harbor.models.agent.context import AgentContext
 
 
 class PiAgent(BaseInstalledAgent):
@@ -55,6 +64,18 @@ class PiAgent(BaseInstalledAgent):
         "PI_CACHE_RETENTION",
     )
 
+    # Usage field aliases across providers, in lookup order.
+    _INPUT_TOKEN_KEYS = ("input", "inputTokens", "input_tokens", "prompt_tokens")
+    _CACHE_TOKEN_KEYS = (
+        "cacheRead",
+        "cache_read_tokens",
+        "cache_read_input_tokens",
+        "cached_tokens",
+    )
+    _OUTPUT_TOKEN_KEYS = ("output", "outputTokens", "output_tokens", "completion_tokens")
+    _COST_TOTAL_KEYS = ("total", "totalUsd", "total_usd")
+    _USAGE_COST_KEYS = ("costUsd", "cost_usd")
+
     def __init__(
         self,
         provider: str | None = None,
@@ -81,6 +102,8 @@ class PiAgent(BaseInstalledAgent):
         return Path(__file__).parent / "install-pi.sh.j2"
 
     def _build_env(self) -> dict[str, str]:
+        from harbor.models.trial.paths import EnvironmentPaths
+
         env: dict[str, str] = {
             # Keep pi state isolated per-trial and persisted in /logs/agent.
             "PI_CODING_AGENT_DIR": (EnvironmentPaths.agent_dir / "pi-home").as_posix(),
@@ -124,27 +147,80 @@ class PiAgent(BaseInstalledAgent):
         return 0.0
 
     @classmethod
-    def _first_int(cls, payload: dict[str, object], *keys: str) -> int:
+    def _first_int(cls, payload: dict[str, object], keys: tuple[str, ...]) -> int:
         for key in keys:
-            if key in payload and payload[key] is not None:
-                return cls._coerce_int(payload[key])
+            value = payload.get(key)
+            if value is None:
+                continue
+            # Parsed JSON counts are almost always plain ints.
+            if type(value) is int:
+                return value
+            return cls._coerce_int(value)
         return 0
 
     @classmethod
-    def _extract_usage_from_stdout(cls, stdout_path: Path) -> dict[str, float | int] | None:
-        lines = stdout_path.read_text(errors="replace").splitlines()
+    def _first_float(cls, payload: dict[str, object], keys: tuple[str, ...]) -> float:
+        # Falsy values (0, "") fall through to the next alias.
+        for key in keys:
+            value = payload.get(key)
+            if not value:
+                continue
+            if type(value) is float:
+                return value
+            return cls._coerce_float(value)
+        return 0.0
 
+    @staticmethod
+    def _file_size(path: str) -> int | None:
+        # One stat instead of an exists() probe followed by stat().
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return None
+
+    @staticmethod
+    def _iter_lines_reversed(path: str | Path) -> Iterator[bytes]:
+        # The agent_end record is at the tail of the transcript, so walk the
+        # file backwards through a read-only mapping instead of loading it all.
+        with open(path, "rb") as handle:
+            try:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped.
+                return
+
+            with mapped:
+                end = len(mapped)
+                while end > 0:
+                    start = mapped.rfind(b"\n", 0, end) + 1
+                    yield mapped[start:end]
+                    end = start - 1
+
+    @classmethod
+    def _extract_usage_from_stdout(cls, stdout_path: str | Path) -> dict[str, float | int] | None:
         messages: list[dict[str, object]] | None = None
-        for line in reversed(lines):
-            stripped = line.strip()
-            if not stripped:
+        for line in cls._iter_lines_reversed(stdout_path):
+            # Cheap substring test so only candidate lines pay for a JSON parse.
+            if b'"agent_end"' not in line:
                 continue
 
-            try:
-                payload = json.loads(stripped)
-            except json.JSONDecodeError:
+            # pi's stderr shares the stream, so a record may carry a stray
+            # prefix; start decoding at the first brace instead of failing.
+            start = line.find(b"{")
+            if start == -1:
                 continue
 
+            try:
+                payload = json_loads(line[start:])
+            except (JSONDecodeError, UnicodeDecodeError):
+                # orjson rejects escaped lone surrogates, which Node emits when
+                # a string is cut mid-emoji, and both parsers reject invalid
+                # UTF-8; retry with the stdlib on a lossily decoded line.
+                try:
+                    payload = json.loads(line[start:].decode(errors="replace"))
+                except ValueError:
+                    continue
+
             if not isinstance(payload, dict) or payload.get("type") != "agent_end":
                 continue
 
@@ -172,27 +248,9 @@ class PiAgent(BaseInstalledAgent):
 
             found_usage = True
 
-            prompt_tokens = cls._first_int(
-                usage,
-                "input",
-                "inputTokens",
-                "input_tokens",
-                "prompt_tokens",
-            )
-            cache_tokens = cls._first_int(
-                usage,
-                "cacheRead",
-                "cache_read_tokens",
-                "cache_read_input_tokens",
-                "cached_tokens",
-            )
-            output_tokens = cls._first_int(
-                usage,
-                "output",
-                "outputTokens",
-                "output_tokens",
-                "completion_tokens",
-            )
+            prompt_tokens = cls._first_int(usage, cls._INPUT_TOKEN_KEYS)
+            cache_tokens = cls._first_int(usage, cls._CACHE_TOKEN_KEYS)
+            output_tokens = cls._first_int(usage, cls._OUTPUT_TOKEN_KEYS)
 
             n_input_tokens += prompt_tokens + cache_tokens
             n_output_tokens += output_tokens
@@ -200,15 +258,9 @@ class PiAgent(BaseInstalledAgent):
 
             raw_cost = usage.get("cost")
             if isinstance(raw_cost, dict):
-                cost_usd += cls._coerce_float(
-                    raw_cost.get("total")
-                    or raw_cost.get("totalUsd")
-                    or raw_cost.get("total_usd")
-                )
+                cost_usd += cls._first_float(raw_cost, cls._COST_TOTAL_KEYS)
             else:
-                cost_usd += cls._coerce_float(
-                    usage.get("costUsd") or usage.get("cost_usd")
-                )
+                cost_usd += cls._first_float(usage, cls._USAGE_COST_KEYS)
 
         if not found_usage:
             return None
@@ -261,7 +313,7 @@ class PiAgent(BaseInstalledAgent):
         return [ExecInput(command=command, env=self._build_env())]
 
     def populate_context_post_run(self, context: AgentContext) -> None:
-        command_dir = self.logs_dir / "command-0"
+        command_dir = os.path.join(self.logs_dir, "command-0")
 
         metadata: dict[str, object] = {
             "provider": self._provider,
@@ -272,17 +324,21 @@ class PiAgent(BaseInstalledAgent):
             "extra_args": self._extra_args,
         }
 
-        return_code_path = command_dir / "return-code.txt"
-        if return_code_path.exists():
-            raw = return_code_path.read_text().strip()
+        try:
+            with open(os.path.join(command_dir, "return-code.txt")) as handle:
+                raw = handle.read().strip()
+        except FileNotFoundError:
+            pass
+        else:
             try:
                 metadata["pi_return_code"] = int(raw)
             except ValueError:
                 metadata["pi_return_code"] = raw
 
-        stdout_path = command_dir / "stdout.txt"
-        if stdout_path.exists():
-            metadata["pi_stdout_bytes"] = stdout_path.stat().st_size
+        stdout_path = os.path.join(command_dir, "stdout.txt")
+        stdout_size = self._file_size(stdout_path)
+        if stdout_size is not None:
+            metadata["pi_stdout_bytes"] = stdout_size
             usage = self._extract_usage_from_stdout(stdout_path)
             if usage:
                 context.n_input_tokens = int(usage["n_input_tokens"])
@@ -297,8 +353,8 @@ class PiAgent(BaseInstalledAgent):
             else:
                 metadata["usage_parsed"] = False
 
-        stderr_path = command_dir / "stderr.txt"
-        if stderr_path.exists():
-            metadata["pi_stderr_bytes"] = stderr_path.stat().st_size
+        stderr_size = self._file_size(os.path.join(command_dir, "stderr.txt"))
+        if stderr_size is not None:
+            metadata["pi_stderr_bytes"] = stderr_size
 
         context.metadata = metadata
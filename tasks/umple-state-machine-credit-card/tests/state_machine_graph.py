@@ -4,14 +4,27 @@ Source of truth for task verifier copies.
 Run scripts/sync_state_machine_graph.sh to update task-local copies.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
+import functools
+import hashlib
 from importlib import util
 import inspect
 import itertools
+import os
 from pathlib import Path
+import shutil
+import subprocess
+import tempfile
 from typing import List, Optional, Tuple
 
+# Kept beside this module: the tests directory is only uploaded at verification
+# time, so unlike /tmp the agent cannot plant a generated oracle there.
+ORACLE_CACHE_DIR = Path(__file__).resolve().parent / ".umple-oracle-cache"
+# Umple code generation is a short one-shot run: C1-only JIT and the serial
+# collector cut JVM startup without affecting the generated code.
+JAVA_STARTUP_OPTS = ("-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC")
+
 
 @dataclass(frozen=True)
 class MachineContext:
@@ -25,6 +38,33 @@ class MachineModel:
     state_count: int
     initial_index: int
     adjacency: Tuple[Tuple[int, ...], ...]
+    # Supported edges packed per source row: bit j of row i is set if i -> j.
+    row_masks: Tuple[int, ...] = field(init=False, repr=False, compare=False)
+    # Number of supported edges (parallel transitions counted once).
+    edge_count: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        masks = tuple(
+            sum(1 << j for j, count in enumerate(row) if count > 0)
+            for row in self.adjacency
+        )
+        object.__setattr__(self, "row_masks", masks)
+        object.__setattr__(
+            self, "edge_count", sum(bin(mask).count("1") for mask in masks)
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _exec_module(module_path: Path, mtime_ns: int):
+    # Keyed on mtime so a regenerated file is executed again. Modules are
+    # deliberately kept out of sys.modules: oracle and candidate share a stem.
+    spec = util.spec_from_file_location(module_path.stem, module_path)
+    loader = spec.loader if spec is not None else None
+    if loader is None:
+        raise ImportError(f"No loader for {module_path}")
+    module = util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
 
 
 def load_class(
@@ -32,13 +72,12 @@ def load_class(
     class_name: Optional[str] = None,
     strict_class_name: bool = True,
 ):
-    if not module_path.exists():
-        raise FileNotFoundError(f"Expected {module_path} to exist")
+    try:
+        mtime_ns = module_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Expected {module_path} to exist") from None
 
-    spec = util.spec_from_file_location(module_path.stem, module_path)
-    module = util.module_from_spec(spec)
-    assert spec.loader is not None
-    spec.loader.exec_module(module)
+    module = _exec_module(module_path, mtime_ns)
 
     if class_name is not None:
         if hasattr(module, class_name):
@@ -52,23 +91,157 @@ def load_class(
     raise RuntimeError(f"No class found in module {module_path}")
 
 
-def discover_machine_contexts(cls) -> List[MachineContext]:
+def _generated_module_path(umple_source: str, class_name: str, umple_jar: Path) -> Path:
+    key = hashlib.sha1(
+        umple_source.encode("utf-8") + str(umple_jar.stat().st_mtime_ns).encode()
+    ).hexdigest()
+    return ORACLE_CACHE_DIR / key / f"{class_name}.py"
+
+
+class PendingUmpleClass:
+    """Umple-to-Python generation running in the background.
+
+    The JVM starts on construction, so callers can do other work before
+    result() waits for it and loads the class. Generated modules are cached
+    in ORACLE_CACHE_DIR, keyed by the source and the jar's mtime, and the JVM
+    only runs on a cache miss. Use as a context manager so an unfinished generation is
+    stopped and cleaned up on error.
+    """
+
+    def __init__(
+        self,
+        umple_source: str,
+        class_name: str,
+        umple_jar: Path,
+        strict_class_name: bool = True,
+    ):
+        self.class_name = class_name
+        self.strict_class_name = strict_class_name
+        self.module_path = _generated_module_path(umple_source, class_name, umple_jar)
+        self._process: Optional[subprocess.Popen] = None
+        self._tmpdir: Optional[tempfile.TemporaryDirectory] = None
+
+        if self.module_path.exists():
+            return
+
+        self._tmpdir = tempfile.TemporaryDirectory()
+        umple_file = Path(self._tmpdir.name) / "oracle.ump"
+        umple_file.write_text(umple_source, encoding="utf-8")
+        self._process = subprocess.Popen(
+            [
+                "java",
+                *JAVA_STARTUP_OPTS,
+                "-jar",
+                str(umple_jar),
+                "-g",
+                "Python",
+                str(umple_file),
+            ],
+            cwd=self._tmpdir.name,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+    def result(self):
+        if self._process is not None:
+            stdout, stderr = self._process.communicate()
+            returncode = self._process.returncode
+            self._process = None
+            try:
+                if returncode != 0:
+                    raise RuntimeError(
+                        "Failed to generate oracle Python from Umple:\n"
+                        f"{stdout}\n{stderr}"
+                    )
+
+                # Publish atomically so a concurrent run never sees a partial file.
+                generated = Path(self._tmpdir.name) / f"{self.class_name}.py"
+                try:
+                    self.module_path.parent.mkdir(parents=True, exist_ok=True)
+                    staged = self.module_path.with_suffix(f".{os.getpid()}.tmp")
+                    shutil.copyfile(generated, staged)
+                    os.replace(staged, self.module_path)
+                except OSError:
+                    # Read-only tests directory: load without caching.
+                    return load_class(
+                        generated,
+                        self.class_name,
+                        strict_class_name=self.strict_class_name,
+                    )
+            finally:
+                self.close()
+
+        return load_class(
+            self.module_path,
+            self.class_name,
+            strict_class_name=self.strict_class_name,
+        )
+
+    def close(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _parameter_count(function) -> int:
+    # The count inspect.signature() reports, read straight from the code object.
+    code = function.__code__
+    return (
+        code.co_argcount
+        + code.co_kwonlyargcount
+        + bool(code.co_flags & inspect.CO_VARARGS)
+        + bool(code.co_flags & inspect.CO_VARKEYWORDS)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _class_members(cls):
+    """Return (enum classes, (name, function, parameter count) triples) of cls."""
+    if cls.__mro__ == (cls, object):
+        # Generated classes have no bases; reading their namespace directly
+        # skips getmembers' per-attribute getattr calls.
+        members = []
+        for name, obj in sorted(vars(cls).items()):
+            if isinstance(obj, staticmethod):
+                obj = obj.__func__
+            members.append((name, obj))
+    else:
+        members = inspect.getmembers(cls)
+
     enum_classes = []
-    for _, obj in inspect.getmembers(cls, inspect.isclass):
-        if obj is Enum:
-            continue
-        if issubclass(obj, Enum):
-            enum_classes.append(obj)
+    functions = []
+    for name, obj in members:
+        if inspect.isclass(obj):
+            if obj is not Enum and issubclass(obj, Enum):
+                enum_classes.append(obj)
+        elif inspect.isfunction(obj):
+            functions.append((name, obj, _parameter_count(obj)))
+    return tuple(enum_classes), tuple(functions)
+
+
+def discover_machine_contexts(cls) -> List[MachineContext]:
+    enum_classes, functions = _class_members(cls)
 
     if not enum_classes:
         raise AssertionError("No state machine enums discovered")
 
     getter_methods = []
     probe = cls()
-    for name, method in inspect.getmembers(cls, inspect.isfunction):
+    for name, _, parameter_count in functions:
         if not name.startswith("get") or name.endswith("FullName"):
             continue
-        if len(inspect.signature(method).parameters) != 1:
+        if parameter_count != 1:
             continue
         try:
             value = getattr(probe, name)()
@@ -96,14 +269,14 @@ def discover_machine_contexts(cls) -> List[MachineContext]:
 
 def discover_event_names(cls, excluded_names) -> List[str]:
     events = []
-    for name, method in inspect.getmembers(cls, inspect.isfunction):
+    for name, _, parameter_count in _class_members(cls)[1]:
         if name.startswith("_"):
             continue
         if name in excluded_names:
             continue
         if name.startswith("get") and name.endswith("FullName"):
             continue
-        if len(inspect.signature(method).parameters) != 1:
+        if parameter_count != 1:
             continue
 
         probe = cls()
@@ -129,25 +302,32 @@ def extract_machine_model(
         raise AssertionError("No states discovered")
 
     index = {state: idx for idx, state in enumerate(states)}
-    probe = cls()
-    initial_state = getattr(probe, context.getter_name)()
-    initial_index = index[initial_state]
+    # Resolve the plain functions once and call them with the instance, rather
+    # than looking up a bound method by name for every probe.
+    getter = getattr(cls, context.getter_name)
+    setter = getattr(cls, context.setter_name)
+    events = [(event, getattr(cls, event)) for event in event_names]
+    initial_index = index[getter(cls())]
 
     adjacency = [[0 for _ in states] for _ in states]
 
     for source in states:
-        for event in event_names:
+        row = adjacency[index[source]]
+
+        for event, fire in events:
+            # A fresh instance per probe: events may mutate containers (e.g. a
+            # queued-message list), which must not leak into the next probe.
             obj = cls()
-            getattr(obj, context.setter_name)(source)
-            before = getattr(obj, context.getter_name)()
-            result = getattr(obj, event)()
-            after = getattr(obj, context.getter_name)()
+            setter(obj, source)
+            before = getter(obj)
+            result = fire(obj)
+            after = getter(obj)
 
             if not isinstance(result, bool):
                 continue
             if result:
-                adjacency[index[source]][index[after]] += 1
-            elif (not result) and after != before:
+                row[index[after]] += 1
+            elif (not result) and after is not before:
                 raise AssertionError(
                     f"Event {event} returned False but changed state "
                     f"from {before} to {after}"
@@ -161,7 +341,8 @@ def extract_machine_model(
     )
 
 
-def extract_all_machine_models(cls) -> List[MachineModel]:
+@functools.lru_cache(maxsize=None)
+def _extract_all_machine_models(cls) -> Tuple[MachineModel, ...]:
     contexts = discover_machine_contexts(cls)
     excluded_names = {"__init__", "delete"}
     for context in contexts:
@@ -169,45 +350,131 @@ def extract_all_machine_models(cls) -> List[MachineModel]:
         excluded_names.add(context.setter_name)
 
     event_names = discover_event_names(cls, excluded_names)
-    return [extract_machine_model(cls, context, event_names) for context in contexts]
+    return tuple(extract_machine_model(cls, context, event_names) for context in contexts)
 
 
-def supported_edges(model: MachineModel) -> Tuple[Tuple[int, ...], ...]:
-    return tuple(
-        tuple(1 if count > 0 else 0 for count in row) for row in model.adjacency
-    )
+def extract_all_machine_models(cls) -> List[MachineModel]:
+    # Models are immutable, so the per-class result is memoized and only the
+    # list wrapper is rebuilt for each caller.
+    return list(_extract_all_machine_models(cls))
+
+
+def _successor_lists(model: MachineModel) -> List[Tuple[int, ...]]:
+    n = model.state_count
+    return [tuple(j for j in range(n) if mask >> j & 1) for mask in model.row_masks]
+
+
+def _wl_colors(model: MachineModel, rounds: int = 3) -> Tuple[int, ...]:
+    """Weisfeiler-Lehman vertex colors over supported edges.
+
+    Colors are seeded with (is_initial, in-degree, out-degree) and refined with
+    the sorted colors of each vertex's successors and predecessors. Isomorphic
+    machines always receive the same color multiset, and an isomorphism can
+    only map a vertex to one of the same color.
+    """
+    n = model.state_count
+    successors = _successor_lists(model)
+    predecessors: List[List[int]] = [[] for _ in range(n)]
+    for i, targets in enumerate(successors):
+        for j in targets:
+            predecessors[j].append(i)
+
+    colors = [
+        hash((i == model.initial_index, len(predecessors[i]), len(successors[i])))
+        for i in range(n)
+    ]
+    for _ in range(rounds):
+        colors = [
+            hash(
+                (
+                    colors[i],
+                    tuple(sorted(colors[j] for j in successors[i])),
+                    tuple(sorted(colors[j] for j in predecessors[i])),
+                )
+            )
+            for i in range(n)
+        ]
+    return tuple(colors)
 
 
 def isomorphic_up_to_renaming(reference: MachineModel, candidate: MachineModel):
     if reference.state_count != candidate.state_count:
         return False, "State count mismatch"
 
-    reference_edges = supported_edges(reference)
-    candidate_edges = supported_edges(candidate)
+    no_match = (False, "No graph isomorphism found with initial-state preservation")
 
     n = reference.state_count
-    ref_initial = reference.initial_index
-    cand_initial = candidate.initial_index
-    ref_rest = [i for i in range(n) if i != ref_initial]
-    cand_rest = [i for i in range(n) if i != cand_initial]
-
-    for perm in itertools.permutations(cand_rest):
-        mapping = {ref_initial: cand_initial}
-        for ref_idx, cand_idx in zip(ref_rest, perm):
-            mapping[ref_idx] = cand_idx
-
-        matches = True
-        for i in range(n):
-            for j in range(n):
-                if reference_edges[i][j] != candidate_edges[mapping[i]][mapping[j]]:
-                    matches = False
-                    break
-            if not matches:
-                break
-        if matches:
-            return True, "ok"
-
-    return False, "No graph isomorphism found with initial-state preservation"
+    # Only vertices of equal color can correspond. Keying on the initial flag
+    # as well pins the initial state explicitly, independent of hash values.
+    ref_keys = [
+        (i == reference.initial_index, color)
+        for i, color in enumerate(_wl_colors(reference))
+    ]
+    cand_keys = [
+        (i == candidate.initial_index, color)
+        for i, color in enumerate(_wl_colors(candidate))
+    ]
+    if sorted(ref_keys) != sorted(cand_keys):
+        return no_match
+
+    cand_buckets: dict = {}
+    for i, key in enumerate(cand_keys):
+        cand_buckets.setdefault(key, []).append(i)
+
+    ref_masks = reference.row_masks
+    cand_masks = candidate.row_masks
+    degree = [bin(mask).count("1") for mask in ref_masks]
+    for mask in ref_masks:
+        for j in range(n):
+            degree[j] += mask >> j & 1
+
+    # Assign the most constrained states first (fewest candidates, then most
+    # edges) so inconsistent partial mappings are cut off near the root.
+    order = sorted(range(n), key=lambda v: (len(cand_buckets[ref_keys[v]]), -degree[v]))
+
+    # mapping[v] is the candidate state assigned to reference state v; the
+    # states mapped so far are exactly order[:depth].
+    mapping = [-1] * n
+    used = [False] * n
+
+    def consistent(v: int, cv: int, depth: int) -> bool:
+        if (ref_masks[v] >> v & 1) != (cand_masks[cv] >> cv & 1):
+            return False
+        for u in order[:depth]:
+            cu = mapping[u]
+            if (ref_masks[v] >> u & 1) != (cand_masks[cv] >> cu & 1):
+                return False
+            if (ref_masks[u] >> v & 1) != (cand_masks[cu] >> cv & 1):
+                return False
+        return True
+
+    def search(depth: int) -> bool:
+        if depth == n:
+            return True
+        v = order[depth]
+        for cv in cand_buckets[ref_keys[v]]:
+            if used[cv] or not consistent(v, cv, depth):
+                continue
+            mapping[v] = cv
+            used[cv] = True
+            if search(depth + 1):
+                return True
+            used[cv] = False
+        return False
+
+    if search(0):
+        return True, "ok"
+    return no_match
+
+
+def _fingerprint(model: MachineModel):
+    """Renaming-invariant summary: state count, edge count and degree multisets."""
+    n = model.state_count
+    out_degrees = sorted(bin(mask).count("1") for mask in model.row_masks)
+    in_degrees = sorted(
+        sum(mask >> j & 1 for mask in model.row_masks) for j in range(n)
+    )
+    return (n, model.edge_count, tuple(out_degrees), tuple(in_degrees))
 
 
 def machine_sets_isomorphic(
@@ -221,18 +488,41 @@ def machine_sets_isomorphic(
             f"got {len(candidate_models)}",
         )
 
-    n = len(reference_models)
-    for perm in itertools.permutations(range(n)):
-        all_match = True
-        for ref_idx, cand_idx in enumerate(perm):
-            ok, _ = isomorphic_up_to_renaming(
+    no_match = (False, "No isomorphic mapping found between state machines")
+
+    # Isomorphic machines share a fingerprint, so only machines within the same
+    # fingerprint bucket can be paired.
+    ref_buckets: dict = {}
+    cand_buckets: dict = {}
+    for idx, model in enumerate(reference_models):
+        ref_buckets.setdefault(_fingerprint(model), []).append(idx)
+    for idx, model in enumerate(candidate_models):
+        cand_buckets.setdefault(_fingerprint(model), []).append(idx)
+    if {key: len(v) for key, v in ref_buckets.items()} != {
+        key: len(v) for key, v in cand_buckets.items()
+    }:
+        return no_match
+
+    pair_results: dict = {}
+
+    def pair_matches(ref_idx: int, cand_idx: int) -> bool:
+        key = (ref_idx, cand_idx)
+        if key not in pair_results:
+            pair_results[key], _ = isomorphic_up_to_renaming(
                 reference_models[ref_idx],
                 candidate_models[cand_idx],
             )
-            if not ok:
-                all_match = False
-                break
-        if all_match:
+        return pair_results[key]
+
+    keys = list(ref_buckets)
+    for perms in itertools.product(
+        *(itertools.permutations(cand_buckets[key]) for key in keys)
+    ):
+        if all(
+            pair_matches(ref_idx, cand_idx)
+            for key, perm in zip(keys, perms)
+            for ref_idx, cand_idx in zip(ref_buckets[key], perm)
+        ):
             return True, "ok"
 
-    return False, "No isomorphic mapping found between state machines"
+    return no_match
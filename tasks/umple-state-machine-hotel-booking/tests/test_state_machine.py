@@ -6,11 +6,10 @@ Parallel transitions between the same source/target are treated as equivalent.
 """
 
 from pathlib import Path
-import subprocess
 import sys
-import tempfile
 
 from state_machine_graph import (
+    PendingUmpleClass,
     extract_all_machine_models,
     load_class,
     machine_sets_isomorphic,
@@ -36,34 +35,16 @@ ORACLE_UMPLE = """class Room {
 """
 
 
-def load_oracle_class():
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmp_path = Path(tmpdir)
-        oracle_ump = tmp_path / "oracle.ump"
-        oracle_ump.write_text(ORACLE_UMPLE, encoding="utf-8")
-
-        result = subprocess.run(
-            ["java", "-jar", str(UMPLE_JAR), "-g", "Python", str(oracle_ump)],
-            cwd=tmpdir,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            raise RuntimeError(
-                "Failed to generate oracle Python from Umple:\n"
-                f"{result.stdout}\n{result.stderr}"
-            )
-
-        return load_class(tmp_path / f"{EXPECTED_CLASS_NAME}.py", EXPECTED_CLASS_NAME)
+def start_oracle_class():
+    return PendingUmpleClass(ORACLE_UMPLE, EXPECTED_CLASS_NAME, UMPLE_JAR)
 
 
 def main():
-    candidate_class = load_class(CANDIDATE_MODULE_PATH, EXPECTED_CLASS_NAME)
-    oracle_class = load_oracle_class()
-
-    candidate_models = extract_all_machine_models(candidate_class)
-    oracle_models = extract_all_machine_models(oracle_class)
+    # Generate the oracle in the background while the candidate is probed.
+    with start_oracle_class() as pending_oracle:
+        candidate_class = load_class(CANDIDATE_MODULE_PATH, EXPECTED_CLASS_NAME)
+        candidate_models = extract_all_machine_models(candidate_class)
+        oracle_models = extract_all_machine_models(pending_oracle.result())
 
     equivalent, reason = machine_sets_isomorphic(oracle_models, candidate_models)
     assert equivalent, (